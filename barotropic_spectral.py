@@ -11,6 +11,7 @@ from mpl_toolkits import basemap
 import spharm
 import os
 from hyperdiffusion import del4_filter, apply_des_filter
+from forcing import ForcingEngine, ForcingSource
 import namelist as NL # <---- IMPORTANT! Namelist containing constants and other model parameters
 
 
@@ -30,6 +31,9 @@ class Model:
                    keys: u_bar, v_bar, u_prime, v_prime, lats, lons, start_time
         forcing -> a 2D array (same shape as model fields) containing a
                    vorticity tendency [s^-2] to be imposed at each integration time step
+                   (for the first NL.forcing_time seconds, if NL.use_forcing is True), or a
+                   ForcingEngine of localized, time-dependent sources (always applied; each
+                   source has its own time window)
         """
         # 1) STORE SPACE/TIME VARIABLES (DIMENSIONS)
         # Get the latitudes and longitudes (as lists)
@@ -149,87 +153,66 @@ class Model:
         #plt.show()
  
         #stop 
-    #==== Primary function: model integrator =========================================    
-    def integrate(self):
-        """ 
-        Integrates the barotropic model using spherical harmonics.
-        Simulation configuration is set in namelist.py
+
+    def grid_metrics(self):
+        """
+        Returns the radian grid spacings and latitudes used by the finite-difference
+        derivatives in the vorticity tendency equation.
+        
+        Returns:
+        dlamb --> 2D array of longitude spacing [radians]
+        dtheta -> 2D array of latitude spacing [radians]
+        theta --> 2D array of latitudes [radians]
         """
         # Create a radian grid
         lat_list_r = [x * np.pi/180. for x in self.lats]
         lon_list_r = [x * np.pi/180. for x in self.lons]
-
-        # Meshgrid
-        lons,lats = np.meshgrid(self.lons, self.lats)
         lamb, theta = np.meshgrid(lon_list_r, lat_list_r)
-
-        # Need these for derivatives later
         dlamb = np.gradient(lamb)[1]
         dtheta = np.gradient(theta)[0]
+        return dlamb, dtheta, theta
+
+    #==== Primary function: model integrator =========================================    
+    def integrate(self, trajectories=None):
+        """ 
+        Integrates the barotropic model using spherical harmonics.
+        Simulation configuration is set in namelist.py
+        
+        Requires:
+        trajectories -> (optional) a Trajectories object whose parcels are advected
+                        by the total winds alongside the integration
+        """
+        # Grid spacings (radians) needed for derivatives later
+        dlamb, dtheta, theta = self.grid_metrics()
+
+        # Store the initial parcel positions and winds
+        if trajectories is not None:
+            trajectories.start(self.up + self.ub, self.vp + self.vb)
 
         # Plot Initial Conditions
         if NL.plot_freq != 0:
             self.plot_figures(0)
 
         # Now loop through the timesteps
+        vortp_prev = None
         for n in range(NL.ntimes):
            
             #if n > 1000:
             #    self.topo[:,:] = 0
-            # Leapfrog:
-            if NL.integration_method == 'leapfrog':
-                vort_tend = self.gettend(self.vortp, dlamb, dtheta, theta, n)
-                print(np.max(vort_tend), np.min(vort_tend))
-                if n == 0:
-                    # First step just do forward difference
-                    # Vorticity at next time is just vort + vort_tend * dt
-                    vortp_next = self.vortp + vort_tend * NL.dt
-                else:
-                    # Otherwise do leapfrog
-                    vortp_next = vortp_prev + vort_tend * 2 * NL.dt
-
-            elif NL.integration_method == 'rk4':
-                h = NL.dt
-                # runge kutta requires 4 estimates of the tendency equation 
-                vortp = self.vortp
-
-                k1 = self.gettend(vortp, dlamb, dtheta, theta, n)
-#               print("k1:",np.max(k1), np.min(k1))
-                k2 = self.gettend(vortp + 0.5 * h * k1, dlamb, dtheta, theta, n)
-#               print("k2:",np.max(k2), np.min(k2))
-                k3 = self.gettend(vortp + 0.5 * h * k2, dlamb, dtheta, theta, n)
-#               print("k3:",np.max(k3), np.min(k3))
-                k4 = self.gettend(vortp + h * k3, dlamb, dtheta, theta, n)
-#               print("k4:",np.max(k4), np.min(k4))
-                vortp_next = vortp + h*(k1 + 2*k2 + 2*k3 + k4)/6.
-#               print("VORTP NEXT:",np.max(vortp_next), np.min(vortp_next))
-    
-            if np.isnan(vortp_next).any():
+            try:
+                vortp_prev = self.step(vortp_prev, n * NL.dt, NL.dt, (dlamb, dtheta, theta))
+            except FloatingPointError:
                 print("BOOM.")
                 print("Looks like your model blew up.  Change the dt or try a different model!")
                 print("The barotropic model will exit now.")
                 sys.exit()
 
-            # First go back to spectral space
-            vortp_spec = self.s.grdtospec(vortp_next)
-            div_spec = np.zeros(np.shape(vortp_spec))  # Divergence is zero in barotropic vorticity
-
-            # Now use the spharm methods to update the u and v grid
-            self.up, self.vp = self.s.getuv(vortp_spec, div_spec)
-            self.psip, chi = self.s.getpsichi(self.up, self.vp)
-
-            # Update the vorticity
-            self.vortp = self.s.spectogrd(vortp_spec)
+            # Advect the parcels with the winds at the start and end of the step
+            if trajectories is not None:
+                trajectories.step(self.up + self.ub, self.vp + self.vb, NL.dt)
 
             # Invert this new vort to get the new psi (or rather, uv winds)
             self.tot_ke.append(np.sum(np.power(self.up+self.ub,2) + np.power(self.vp+self.vb,2)))
-            # Change vort_now to vort_prev
-            # and if not first step, add Robert filter to dampen out crazy modes
-            if NL.integration_method == 'leapfrog':
-                if n == 0:
-                    vortp_prev = self.vortp
-                else:
-                    vortp_prev = (1.-2.*NL.r)*self.vortp + NL.r*(vortp_next + vortp_prev)
 
             # Update the current time  
             cur_fhour = (n+1) * NL.dt / 3600.
@@ -240,9 +223,91 @@ class Model:
                 # Go from psi to geopotential
                 print("Plotting hour", cur_fhour)
                 self.plot_figures(int(cur_fhour))
+
+        # Write out any remaining parcel positions
+        if trajectories is not None:
+            trajectories.close()
                 
-    def gettend(self,vortp, dlamb, dtheta, theta, n):
+    def step(self, vortp_prev, t, dt, metrics, method=None):
+        """
+        Advances the perturbation vorticity, winds and streamfunction one time step.
+        
+        Requires:
+        vortp_prev -> perturbation vorticity at the previous time step (leapfrog only;
+                      None on the first step, which is a forward step)
+        t ----------> time since the model start at the beginning of the step [s]
+        dt ---------> time step [s]
+        metrics ----> tuple of (dlamb, dtheta, theta) from grid_metrics
+        method -----> integration method ('leapfrog', 'rk4'); defaults to NL.integration_method
+        
+        Returns:
+        The vorticity to pass as <vortp_prev> on the next (leapfrog) step
+        (raises a FloatingPointError if the model blows up)
+        """
+        dlamb, dtheta, theta = metrics
+        if method is None:
+            method = NL.integration_method
+
+        # Leapfrog:
+        if method == 'leapfrog':
+            vort_tend = self.gettend(self.vortp, dlamb, dtheta, theta, t, dt)
+            if vortp_prev is None:
+                # First step just do forward difference
+                # Vorticity at next time is just vort + vort_tend * dt
+                vortp_next = self.vortp + vort_tend * dt
+            else:
+                # Otherwise do leapfrog
+                vortp_next = vortp_prev + vort_tend * 2 * dt
+
+        elif method == 'rk4':
+            h = dt
+            # runge kutta requires 4 estimates of the tendency equation 
+            vortp = self.vortp
+
+            k1 = self.gettend(vortp, dlamb, dtheta, theta, t, dt)
+#           print("k1:",np.max(k1), np.min(k1))
+            k2 = self.gettend(vortp + 0.5 * h * k1, dlamb, dtheta, theta, t + 0.5 * h, dt)
+#           print("k2:",np.max(k2), np.min(k2))
+            k3 = self.gettend(vortp + 0.5 * h * k2, dlamb, dtheta, theta, t + 0.5 * h, dt)
+#           print("k3:",np.max(k3), np.min(k3))
+            k4 = self.gettend(vortp + h * k3, dlamb, dtheta, theta, t + h, dt)
+#           print("k4:",np.max(k4), np.min(k4))
+            vortp_next = vortp + h*(k1 + 2*k2 + 2*k3 + k4)/6.
+#           print("VORTP NEXT:",np.max(vortp_next), np.min(vortp_next))
+
+        if np.isnan(vortp_next).any():
+            raise FloatingPointError('the perturbation vorticity became NaN at t = {} s'.format(t + dt))
+
+        self.set_perturbation(vortp_next)
+
+        # Change vort_now to vort_prev
+        # and if not first step, add Robert filter to dampen out crazy modes
+        if method == 'leapfrog' and vortp_prev is not None:
+            return (1.-2.*NL.r)*self.vortp + NL.r*(vortp_next + vortp_prev)
+        return self.vortp
+
+    def set_perturbation(self, vortp):
+        """
+        Sets the perturbation vorticity and the winds/streamfunction derived from it.
+        
+        Requires:
+        vortp -> 2D array (nlats, nlons) of perturbation relative vorticity [s^-1]
+        """
+        # First go back to spectral space
+        vortp_spec = self.s.grdtospec(vortp)
+        div_spec = np.zeros(np.shape(vortp_spec))  # Divergence is zero in barotropic vorticity
+
+        # Now use the spharm methods to update the u and v grid
+        self.up, self.vp = self.s.getuv(vortp_spec, div_spec)
+        self.psip, chi = self.s.getpsichi(self.up, self.vp)
+
+        # Update the vorticity
+        self.vortp = self.s.spectogrd(vortp_spec)
+
+    def gettend(self,vortp, dlamb, dtheta, theta, t, dt=NL.dt):
         # self.psip, self.psib, self.vortp, self.vort_bar
+        # t is the time since the model start (seconds)
+        # dt is the time step the (implicit) hyperdiffusion is applied over (seconds)
         # 
         # Here we actually compute vorticity tendency
         # Compute tendency with beta as only forcing
@@ -254,11 +319,13 @@ class Model:
             vort_tend -= del4_filter(vortp, self.lats, self.lons)
         elif NL.diff_opt=='des':
             vort_tend = apply_des_filter(self.s, vortp, vort_tend, self.ntrunc,
-                                             t = (n+1) * NL.dt / 3600.).squeeze()
+                                             t = (t + dt) / 3600., dt = dt).squeeze()
         
         # Now add any imposed vorticity tendency forcing
-        print(n, NL.forcing_time)
-        if NL.use_forcing is True and n < NL.forcing_time:
+        if isinstance(self.forcing, ForcingEngine):
+            # Only scatters into the footprints of the active sources
+            self.forcing.apply(vort_tend, t)
+        elif NL.use_forcing is True and t < NL.forcing_time:
             vort_tend += self.forcing
 
         # Now add any geographical vorticity tendency forcing
@@ -295,6 +362,9 @@ class Model:
         if psis=='pert':   psi = self.psip
         elif psis=='mean': psi = self.psib
         else:              psi = self.psip + self.psib
+        # Get the forcing at this time (n is in hours)
+        if isinstance(self.forcing, ForcingEngine): forcing = self.forcing.to_grid(n * 3600.)
+        else:                                       forcing = self.forcing
 
         # MAKE GLOBAL ZETA & WIND BARB MAP
         fig, ax = plt.subplots(figsize=(10,8))
@@ -313,8 +383,8 @@ class Model:
         self.bmaps['global'].drawparallels(parallels,labels=[True,False,False,True])
         ax.quiver(xx[::2,::2], yy[::2,::2], u[::2,::2], v[::2,::2])
         # Plot the forcing
-        if showforcing and self.forcing is not None:
-            ax.contour(xx, yy, self.forcing, forcelevs, linewidths=2, colors='darkorchid')
+        if showforcing and forcing is not None:
+            ax.contour(xx, yy, forcing, forcelevs, linewidths=2, colors='darkorchid')
         ax.set_title('relative vorticity [s$^{-1}$] and winds [m s$^{-1}$] at %03d hours' % n)
         # Colorbar
         cax = fig.add_axes([0.05, 0.12, 0.9, 0.03])
@@ -337,8 +407,8 @@ class Model:
         self.bmaps['regional'].drawstates()
         hgtconts = ax.contour(xx, yy, phi, hgtlevs, colors='k')
         # Plot the forcing
-        if showforcing and self.forcing is not None:
-            ax.contour(xx, yy, self.forcing, forcelevs, linewidths=2, colors='darkorchid')
+        if showforcing and forcing is not None:
+            ax.contour(xx, yy, forcing, forcelevs, linewidths=2, colors='darkorchid')
         ax.set_title('geopotential height [m] and wind speed [m s$^{-1}$] at %03d hours' % n)
         # Colorbar
         cax = fig.add_axes([0.05, 0.12, 0.9, 0.03])
@@ -431,19 +501,12 @@ def test_case():
            'start_time' : datetime(2017,1,1,0)}
 
     # 2) LET'S ALSO FEED IN A GAUSSIAN NH RWS FORCING (CAN BE USED TO CREATE SYNTEHTIC HURRICANES)
-    amplitude = NL.forcing_amp              # s^-2
-    forcing = np.zeros(np.shape(ubar))
-    x, y = np.meshgrid(np.linspace(-1,1,10), np.linspace(-1,1,10))
-    d = np.sqrt(x*x+y*y)
-    sigma, mu = 0.5, 0.0
-    g = np.exp(-( (d-mu)**2 / ( 2.0 * sigma**2 ) ) )   # GAUSSIAN CURVE
-    source_lat = NL.forcing_lat; source_lon = NL.forcing_lon # The location of the forcing
-    lat_i = np.where(lats==source_lat)[0][0]
-    lon_i = np.where(lons==source_lon)[0][0]
+    # More sources (each with its own track and time envelope) can be added to the list
     if NL.use_forcing == True:
-        forcing[lat_i:lat_i+10, lon_i:lon_i+10] = g*amplitude
+        source = ForcingSource(NL.forcing_lat, NL.forcing_lon, NL.forcing_amp, end=NL.forcing_time)
+        forcing = ForcingEngine([source], lats, lons)
     else:
-        forcing[:,:] = 0
+        forcing = None
 
     # 3) INTEGRATE!
     model = Model(ics, forcing=forcing)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""
+Module for imposing localized, time-dependent vorticity tendency forcing
+(e.g., synthetic tropical cyclones) in a barotropic model.
+
+Each source is stored compactly (center/track, footprint, time envelope) and
+is added to the vorticity tendency only within its footprint, so the cost of
+the forcing scales with the number of sources rather than the grid size.
+"""
+
+import numpy as np
+import namelist as NL
+
+
+class ForcingSource:
+    """
+    A Gaussian vorticity tendency source with its own position (or track),
+    amplitude and time envelope.
+    """
+
+    def __init__(self, lat, lon, amplitude, width=NL.forcing_width, radius=None,
+                 start=0., end=None, ramp=0., track=None):
+        """
+        Initializes the forcing source.
+
+        Requires:
+        lat, lon --> center of the source (in degrees)
+        amplitude -> peak vorticity tendency [s^-2]
+        width -----> standard deviation of the Gaussian [m] (the e-folding radius is sqrt(2) * width)
+        radius ----> footprint radius beyond which the forcing is zero [m]
+                     (defaults to 3 * width)
+        start -----> time the source switches on [s since model start]
+        end -------> time the source switches off [s since model start] (None = never)
+        ramp ------> time taken to ramp the source on and off [s] (0 = on/off step)
+        track -----> optional tuple of 1D arrays (times [s], lats, lons) along which the
+                     source moves; positions between the track times are interpolated
+        """
+        self.lat = lat
+        self.lon = lon
+        self.amplitude = amplitude
+        self.width = width
+        self.radius = 3 * width if radius is None else radius
+        self.start = start
+        self.end = end
+        self.ramp = ramp
+        if track is None:
+            self.track = None
+        else:
+            times, lats, lons = [np.asarray(x, dtype=float) for x in track]
+            # Unwrap the longitudes so tracks can cross the prime meridian
+            self.track = (times, lats, np.rad2deg(np.unwrap(np.deg2rad(lons))))
+
+    def position(self, t):
+        """ Returns the (lat, lon) center of the source at time t [s] """
+        if self.track is None:
+            return self.lat, self.lon
+        times, lats, lons = self.track
+        return np.interp(t, times, lats), np.interp(t, times, lons) % 360.
+
+    def envelope(self, t):
+        """ Returns the fraction (0-1) of the source amplitude applied at time t [s] """
+        if t < self.start or (self.end is not None and t >= self.end):
+            return 0.
+        if self.ramp <= 0:
+            return 1.
+        env = min(1., (t - self.start) / self.ramp)
+        if self.end is not None:
+            env = min(env, (self.end - t) / self.ramp)
+        return env
+
+
+class ForcingEngine:
+    """
+    Class for storing a set of forcing sources on a model grid and adding
+    them to the vorticity tendency.
+    """
+
+    def __init__(self, sources, lats, lons):
+        """
+        Initializes the forcing engine.
+
+        Requires:
+        sources -> list of ForcingSource objects
+        lats ----> 1D array/list of the model latitudes (in degrees)
+        lons ----> 1D array/list of the model longitudes (in degrees)
+        """
+        self.sources = list(sources)
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+        # Footprints are cached per source and only recomputed when the source moves
+        self.footprints = [None] * len(self.sources)
+
+    def footprint(self, i, lat, lon):
+        """
+        Returns the latitude indices, longitude indices and Gaussian weights
+        (nlat_footprint, nlon_footprint) of source <i> centered at (lat, lon).
+        """
+        cached = self.footprints[i]
+        if cached is not None and cached[0] == (lat, lon):
+            return cached[1]
+
+        source = self.sources[i]
+        # Bounding box of the footprint on the grid
+        dlat_max = np.rad2deg(source.radius / NL.Re)
+        ilat = np.where(np.abs(self.lats - lat) <= dlat_max)[0]
+        coslat = np.cos(np.deg2rad(min(abs(lat) + dlat_max, 89.9)))
+        dlon_max = min(dlat_max / coslat, 180.)
+        dlon = (self.lons - lon + 180.) % 360. - 180.
+        ilon = np.where(np.abs(dlon) <= dlon_max)[0]
+
+        # Great circle distance from the center (haversine formula)
+        phi1 = np.deg2rad(lat)
+        phi2 = np.deg2rad(self.lats[ilat])[:, None]
+        dlamb = np.deg2rad(dlon[ilon])[None, :]
+        a = np.sin((phi2 - phi1) / 2.)**2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlamb / 2.)**2
+        dist = 2 * NL.Re * np.arcsin(np.sqrt(np.clip(a, 0., 1.)))
+
+        weights = np.exp(-dist**2 / (2. * source.width**2))
+        weights[dist > source.radius] = 0.
+        self.footprints[i] = ((lat, lon), (ilat, ilon, weights))
+        return ilat, ilon, weights
+
+    def apply(self, vort_tend, t):
+        """
+        Adds the forcing of every active source at time t [s] to <vort_tend> in place.
+
+        Requires:
+        vort_tend -> 2D array (nlats, nlons) of vorticity tendency [s^-2]
+        t ---------> time since the model start [s]
+
+        Returns:
+        <vort_tend>
+        """
+        for i, source in enumerate(self.sources):
+            env = source.envelope(t)
+            if env == 0:
+                continue
+            lat, lon = source.position(t)
+            ilat, ilon, weights = self.footprint(i, lat, lon)
+            vort_tend[np.ix_(ilat, ilon)] += env * source.amplitude * weights
+        return vort_tend
+
+    def to_grid(self, t):
+        """ Returns the full 2D (nlats, nlons) forcing field at time t [s] (e.g., for plotting) """
+        return self.apply(np.zeros((len(self.lats), len(self.lons))), t)
@@ -219,9 +219,9 @@ def f4(f0, f1, f2, f3, f4, d0, d1, d2, d3):
 #==== L. Madaus's original hyperdiffusion scheme ====================================
 #====================================================================================
 
-def apply_des_filter(s, cur_vort, vort_tend, ntrunc, t=0):
-    """ Add spectral hyperdiffusion and return a new
-    vort_tend """
+def apply_des_filter(s, cur_vort, vort_tend, ntrunc, t=0, dt=NL.dt):
+    """ Add spectral hyperdiffusion (implicit over a time
+    step dt, in seconds) and return a new vort_tend """
     # Convert to spectral grids
     vort_spec = s.grdtospec(cur_vort)
     vort_tend_spec = s.grdtospec(vort_tend)
@@ -235,7 +235,7 @@ def apply_des_filter(s, cur_vort, vort_tend, ntrunc, t=0):
     DES = compute_dampening_eddy_sponge(vort_tend_spec.shape)
 
     num = vort_tend_spec - DES * vort_spec
-    den = np.ones(np.shape(DES), dtype=np.complex) + DES * np.complex(NL.dt,0.)
+    den = np.ones(np.shape(DES), dtype=np.complex) + DES * np.complex(dt,0.)
     new_vort_tend_spec[:,:] = num / den
     
 
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+
+"""
+Module for building barotropic model initial conditions from real-data
+upper-level u/v analyses in netCDF files.
+
+The files are read lazily (one time and level at a time) and regridded to the
+model grid with sparse bilinear interpolation weights, which are computed once
+per (source grid, target grid) pair and cached in memory (and optionally on disk).
+"""
+
+import os
+import hashlib
+import numpy as np
+from netCDF4 import Dataset, num2date
+from scipy import sparse
+import namelist as NL
+
+# Names the coordinate variables/dimensions commonly go by
+LAT_NAMES = ['lat', 'latitude', 'lats']
+LON_NAMES = ['lon', 'longitude', 'lons']
+LEVEL_NAMES = ['level', 'lev', 'plev', 'isobaricInhPa', 'pressure', 'pressure_level']
+TIME_NAMES = ['time', 'valid_time']
+
+# Regridding weights, keyed by the (source grid, target grid) pair
+_weights_cache = {}
+
+
+#====================================================================================
+#==== Regridding ====================================================================
+#====================================================================================
+
+def regrid_weights(src_lats, src_lons, lats, lons, cachedir=NL.regrid_cachedir):
+    """
+    Returns the sparse bilinear interpolation weights from a source lat/lon grid to
+    a target lat/lon grid (periodic in longitude; constant beyond the source's
+    northernmost/southernmost latitudes). The weights are cached per grid pair.
+
+    Requires:
+    src_lats, src_lons -> 1D arrays of the source grid latitudes/longitudes (in degrees)
+    lats, lons ---------> 1D arrays of the target grid latitudes/longitudes (in degrees)
+    cachedir -----------> directory to also cache the weights in (None = memory only)
+
+    Returns:
+    scipy.sparse CSR matrix of shape (len(lats)*len(lons), len(src_lats)*len(src_lons))
+    """
+    grids = [np.ascontiguousarray(x, dtype=np.float64) for x in (src_lats, src_lons, lats, lons)]
+    key = hashlib.sha1(b''.join(g.tobytes() + str(g.shape).encode() for g in grids)).hexdigest()
+    if key in _weights_cache:
+        return _weights_cache[key]
+    if cachedir is not None:
+        fname = os.path.join(cachedir, 'regrid_{}.npz'.format(key))
+        if os.path.isfile(fname):
+            _weights_cache[key] = sparse.load_npz(fname)
+            return _weights_cache[key]
+
+    src_lats, src_lons, lats, lons = grids
+    nsrc_lon = len(src_lons)
+
+    # Latitude: index of the source row below each target latitude (clamped at the edges)
+    lat_order = np.argsort(src_lats)
+    slat = src_lats[lat_order]
+    j = np.clip(np.searchsorted(slat, lats) - 1, 0, len(slat) - 2)
+    wj = np.clip((lats - slat[j]) / (slat[j+1] - slat[j]), 0., 1.)
+    j0, j1 = lat_order[j], lat_order[j+1]
+
+    # Longitude: unique source columns sorted on 0-360, wrapped around once
+    slon, lon_index = np.unique(src_lons % 360., return_index=True)
+    slon = np.append(slon, slon[0] + 360.)
+    lon_index = np.append(lon_index, lon_index[0])
+    tlon = lons % 360.
+    tlon = np.where(tlon < slon[0], tlon + 360., tlon)
+    i = np.clip(np.searchsorted(slon, tlon, side='right') - 1, 0, len(slon) - 2)
+    wi = (tlon - slon[i]) / (slon[i+1] - slon[i])
+    i0, i1 = lon_index[i], lon_index[i+1]
+
+    # Four source points (and weights) for each target point
+    rows = np.arange(len(lats) * len(lons)).reshape(len(lats), len(lons))
+    wj, wi = wj[:, None], wi[None, :]
+    cols = [j0[:, None] * nsrc_lon + i0[None, :], j0[:, None] * nsrc_lon + i1[None, :],
+            j1[:, None] * nsrc_lon + i0[None, :], j1[:, None] * nsrc_lon + i1[None, :]]
+    vals = [(1 - wj) * (1 - wi), (1 - wj) * wi, wj * (1 - wi), wj * wi]
+    weights = sparse.coo_matrix((np.concatenate([v.ravel() for v in vals]),
+                                 (np.tile(rows.ravel(), 4), np.concatenate([c.ravel() for c in cols]))),
+                                shape=(rows.size, len(src_lats) * nsrc_lon)).tocsr()
+
+    _weights_cache[key] = weights
+    if cachedir is not None:
+        if not os.path.isdir(cachedir): os.makedirs(cachedir)
+        sparse.save_npz(fname, weights)
+    return weights
+
+
+def regrid(field, weights, shape):
+    """
+    Regrids a 2D (src_nlats, src_nlons) field with precomputed weights. Missing
+    (masked) source points are left out and the weights renormalized over the
+    valid source points. Target points with no valid source points around them
+    are filled from the nearest valid source points (see fill_missing).
+
+    Requires:
+    field ---> 2D (possibly masked) array on the source grid
+    weights -> sparse weights from regrid_weights
+    shape ---> (nlats, nlons) of the target grid
+
+    Returns:
+    2D array of shape <shape>
+    """
+    values = np.ravel(np.ma.filled(field, 0.))
+    mask = np.ravel(np.ma.getmaskarray(field))
+    if not mask.any():
+        return np.reshape(weights.dot(values), shape)
+
+    valid = (~mask).astype(float)
+    norm = weights.dot(valid)
+    regridded = weights.dot(values * valid) / np.where(norm > 0, norm, 1.)
+    # Target points whose (nonzero) weights all fall on missing values (e.g., a target
+    # point on top of one, or inside a masked block) use the field with its gaps filled
+    empty = norm <= 0
+    if empty.any():
+        filled = fill_missing(np.ma.getdata(field), np.ma.getmaskarray(field))
+        regridded[empty] = weights[empty].dot(np.ravel(filled))
+    return np.reshape(regridded, shape)
+
+
+def fill_missing(field, mask):
+    """
+    Fills the missing points of a 2D (src_nlats, src_nlons) field from the nearest
+    valid points, by repeatedly setting the missing points next to valid ones to the
+    mean of their valid neighbours (periodic in longitude).
+
+    Requires:
+    field -> 2D array on the source grid
+    mask --> 2D boolean array, True where <field> is missing
+
+    Returns:
+    2D array with no missing points
+    """
+    if np.all(mask):
+        raise ValueError('cannot regrid a field with no valid values')
+    filled = np.where(mask, np.nan, np.asarray(field, dtype=float))
+    missing = np.isnan(filled)
+    while missing.any():
+        padded = np.pad(filled, ((1, 1), (0, 0)), constant_values=np.nan)
+        neighbours = np.stack([np.roll(padded[1+dj:padded.shape[0]-1+dj], di, axis=1)
+                               for dj in (-1, 0, 1) for di in (-1, 0, 1) if dj or di])
+        count = np.sum(~np.isnan(neighbours), axis=0)
+        grow = missing & (count > 0)
+        filled[grow] = np.nansum(neighbours, axis=0)[grow] / count[grow]
+        missing = np.isnan(filled)
+    return filled
+
+
+#====================================================================================
+#==== Reading analyses ==============================================================
+#====================================================================================
+
+def read_analyses(filename, lats, lons, level=NL.ingest_level, times=None, uname=NL.ingest_u,
+                  vname=NL.ingest_v, mean='zonal', cachedir=NL.regrid_cachedir, start_time=None):
+    """
+    Generator of model initial conditions from a netCDF file of u/v analyses.
+    Only one time/level of u and v is read from the file at a time.
+
+    Requires:
+    filename -> path to the netCDF file
+    lats -----> 1D array of the model latitudes (in degrees)
+    lons -----> 1D array of the model longitudes (in degrees)
+    level ----> vertical level to read, in the units of the file's level coordinate
+                (ignored if the winds have no level dimension)
+    times ----> list of time indices to read (None = every time in the file)
+    uname ----> name of the zonal wind variable
+    vname ----> name of the meridional wind variable
+    mean -----> how to split the winds into mean and perturbation parts:
+                'zonal' (mean = zonal mean), 'none' (mean = 0), or a tuple of
+                (u_bar, v_bar) arrays on the model grid (e.g., a climatology)
+    cachedir -> directory to also cache the regridding weights in (None = memory only)
+    start_time -> datetime of the analysis, used only if the winds have no time dimension
+                  and the file has no scalar time variable (a ValueError is raised if
+                  neither is available)
+
+    Yields:
+    Dictionary of initial conditions for Model
+    keys: u_bar, v_bar, u_prime, v_prime, lats, lons, start_time
+    """
+    shape = (len(lats), len(lons))
+    _, columns = np.unique(np.round(np.asarray(lons, dtype=float) % 360., 6), return_index=True)
+    with Dataset(filename) as d:
+        uvar, vvar = d[uname], d[vname]
+        dims = uvar.dimensions
+        latdim = find_name(dims, LAT_NAMES)
+        londim = find_name(dims, LON_NAMES)
+        levdim = find_name(dims, LEVEL_NAMES, required=False)
+        timedim = find_name(dims, TIME_NAMES, required=False)
+        other = [dim for dim in dims if dim not in (latdim, londim, levdim, timedim) and len(d.dimensions[dim]) > 1]
+        if other:
+            raise ValueError('{} in {} has unrecognized dimension(s) {}; a single lat/lon slice '
+                             'cannot be selected'.format(uname, filename, other))
+
+        weights = regrid_weights(d[latdim][:], d[londim][:], lats, lons, cachedir=cachedir)
+
+        # Index of the requested level
+        index = {}
+        if levdim is not None:
+            levs = d[levdim][:]
+            ilev = np.argmin(np.abs(levs - level))
+            if not np.isclose(levs[ilev], level):
+                raise ValueError('level {} not found in {}'.format(level, filename))
+            index[levdim] = ilev
+
+        # Valid times
+        if timedim is not None:
+            tvar = d[timedim]
+            if times is None:
+                times = range(len(tvar))
+        else:
+            times = [None]
+            # A single analysis: use a scalar time coordinate if the file has one
+            timevar = find_name(d.variables.keys(), TIME_NAMES, required=False)
+            if timevar is not None and d[timevar].ndim == 0 and hasattr(d[timevar], 'units'):
+                start_time = to_datetime(d[timevar], d[timevar][...])
+            if start_time is None:
+                raise ValueError('{} has no time coordinate; pass start_time'.format(filename))
+
+        for it in times:
+            if it is not None:
+                index[timedim] = it
+                start_time = to_datetime(tvar, tvar[it])
+            # Read just this time/level slice of the winds
+            slc = tuple(index.get(dim, slice(None) if dim in (latdim, londim) else 0) for dim in dims)
+            transpose = dims.index(latdim) > dims.index(londim)
+            u = uvar[slc].T if transpose else uvar[slc]
+            v = vvar[slc].T if transpose else vvar[slc]
+            if np.ndim(u) != 2 or np.shape(u) != np.shape(v):
+                raise ValueError('expected 2D lat/lon slices of {}/{} in {}, got shapes {} and {}'.format(
+                                 uname, vname, filename, np.shape(u), np.shape(v)))
+            u = regrid(u, weights, shape)
+            v = regrid(v, weights, shape)
+
+            # Split into mean and perturbation parts
+            if isinstance(mean, str) and mean == 'zonal':
+                # Average over the unique columns only (the grid may repeat 0 at 360)
+                u_bar = np.repeat(np.mean(u[:, columns], axis=1)[:, None], shape[1], axis=1)
+                v_bar = np.repeat(np.mean(v[:, columns], axis=1)[:, None], shape[1], axis=1)
+            elif isinstance(mean, str) and mean == 'none':
+                u_bar = np.zeros(shape)
+                v_bar = np.zeros(shape)
+            else:
+                u_bar, v_bar = mean
+
+            yield {'u_bar'  : u_bar,
+                   'v_bar'  : v_bar,
+                   'u_prime': u - u_bar,
+                   'v_prime': v - v_bar,
+                   'lons'   : lons,
+                   'lats'   : lats,
+                   'start_time' : start_time}
+
+
+def to_datetime(tvar, value):
+    """ Converts a value of the netCDF time variable <tvar> to a datetime """
+    return num2date(value, tvar.units, calendar=getattr(tvar, 'calendar', 'standard'),
+                    only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+
+
+def find_name(names, candidates, required=True):
+    """ Returns the first of <names> that matches one of the <candidates> (case insensitive) """
+    candidates = [c.lower() for c in candidates]
+    for name in names:
+        if name.lower() in candidates:
+            return name
+    if required:
+        raise ValueError('none of {} found in {}'.format(candidates, names))
+    return None
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+
+"""
+Module for the barotropic vorticity equation linearized about the basic state
+of a barotropic model (Model.ub, Model.vb, Model.vort_bar).
+
+The linearized tendency is built as an operator on the spherical harmonic
+coefficients of the perturbation vorticity, so the leading normal modes of the
+basic state and the steady (stationary-wave) response to topography and
+vorticity forcing can be found with linear solvers instead of a long
+time integration.
+"""
+
+import hashlib
+import numpy as np
+import spharm
+from scipy.sparse.linalg import LinearOperator, eigs, gmres
+from scipy.linalg import lu_factor, lu_solve
+from hyperdiffusion import del4_filter, compute_dampening_eddy_sponge
+import namelist as NL
+
+
+class LinearModel:
+    """
+    Class for the barotropic vorticity equation linearized about the basic state
+    of a Model. Includes the beta effect, topography (through NL.fluid_height) and
+    the same hyperdiffusion that the nonlinear model applies (NL.diff_opt).
+
+    The perturbation state is a real vector holding the real parts of the
+    spectral vorticity coefficients with total wavenumber n > 0, followed by the
+    imaginary parts of the coefficients with zonal wavenumber m > 0 (the imaginary
+    parts of the m = 0 coefficients do not affect a real field).
+    """
+
+    def __init__(self, model):
+        """
+        Initializes the linear model.
+
+        Requires:
+        model --> an initialized Model instance providing the basic state,
+                  topography and spherical harmonic transform object
+        """
+        self.model = model
+        self.s = model.s
+        self.lats = model.lats
+        self.lons = model.lons
+
+        # 1) SPECTRAL BOOKKEEPING
+        # Model.s transforms with the default truncation (nlats - 1)
+        indxm, indxn = spharm.getspecindx(model.nlats() - 1)
+        self.ncoef = len(indxm)
+        self.real_mask = indxn > 0
+        self.imag_mask = indxm > 0
+        self.nstate = np.sum(self.real_mask) + np.sum(self.imag_mask)
+        # Inverse Laplacian eigenvalues to get streamfunction from vorticity
+        self.invlap = np.zeros(self.ncoef)
+        self.invlap[self.real_mask] = -NL.Re**2 / (indxn[self.real_mask] * (indxn[self.real_mask] + 1.))
+
+        # Dampening eddy sponge, ordered as the model's apply_des_filter orders it
+        if NL.diff_opt == 'des':
+            self.DES = compute_dampening_eddy_sponge((model.ntrunc, self.ncoef // model.ntrunc)).real.ravel()
+        else:
+            self.DES = None
+
+        # 2) BASIC STATE DERIVATIVES (these never change)
+        dlamb, dtheta, theta = model.grid_metrics()
+        self.dlamb = dlamb[:, :, None]
+        self.dtheta = dtheta[:, :, None]
+        self.jac_factor = 1. / (NL.Re**2 * np.cos(theta[:, :, None]))
+        self.f = 2 * NL.omega * np.sin(theta[:, :, None])
+        self.dpsib_dlamb = d_dlamb(model.psib[:, :, None], self.dlamb)
+        self.dpsib_dtheta = d_dtheta(model.psib[:, :, None], self.dtheta)
+        self.dvortb_dlamb = d_dlamb(model.vort_bar[:, :, None], self.dlamb)
+        self.dvortb_dtheta = d_dtheta(model.vort_bar[:, :, None], self.dtheta)
+        self.dtopo_dlamb = d_dlamb(model.topo[:, :, None], self.dlamb)
+        self.dtopo_dtheta = d_dtheta(model.topo[:, :, None], self.dtheta)
+
+        # LU factors of the dense operator, cached per (damping rate, topography)
+        self.lu = {}
+
+    #==== Converting between state vectors and spectral coefficients =================
+    def pack(self, vort_spec):
+        """
+        Converts spectral vorticity coefficients (ncoef[, k]) to real state vectors (nstate[, k])
+        """
+        return np.concatenate((vort_spec.real[self.real_mask], vort_spec.imag[self.imag_mask]), axis=0)
+
+    def unpack(self, x):
+        """
+        Converts real state vectors (nstate[, k]) to spectral vorticity coefficients (ncoef[, k])
+        """
+        nreal = np.sum(self.real_mask)
+        vort_spec = np.zeros((self.ncoef,) + x.shape[1:], dtype=complex)
+        vort_spec[self.real_mask] = x[:nreal]
+        vort_spec[self.imag_mask] += 1j * x[nreal:]
+        return vort_spec
+
+    def to_grid(self, vort_spec):
+        """
+        Returns the perturbation vorticity and streamfunction grids (nlats, nlons, k)
+        for spectral vorticity coefficients (ncoef, k)
+        """
+        nt = vort_spec.shape[1]
+        vortp = np.reshape(self.s.spectogrd(vort_spec), (self.model.nlats(), self.model.nlons(), nt))
+        psip = np.reshape(self.s.spectogrd(self.invlap[:, None] * vort_spec),
+                          (self.model.nlats(), self.model.nlons(), nt))
+        return vortp, psip
+
+    #==== The linearized tendency =====================================================
+    def topo_gradients(self, topo=None):
+        """
+        Returns the longitude and latitude derivatives (nlats, nlons, k) of a
+        2D/3D topography field [m] (None = the model's topography).
+        """
+        if topo is None:
+            return self.dtopo_dlamb, self.dtopo_dtheta
+        topo = np.reshape(topo, (self.model.nlats(), self.model.nlons(), -1))
+        return d_dlamb(topo, self.dlamb), d_dtheta(topo, self.dtheta)
+
+    def tendency_spec(self, vort_spec, damping=0., dtopo=None):
+        """
+        Computes the linearized vorticity tendency about the basic state.
+
+        Requires:
+        vort_spec -> 2D array (ncoef, k) of perturbation spectral vorticity coefficients
+        damping ---> linear (Rayleigh) damping rate [s^-1]
+        dtopo -----> tuple of topography derivatives from topo_gradients
+                     (None = the model's topography)
+
+        Returns:
+        2D array (ncoef, k) of spectral vorticity tendency coefficients [s^-2]
+        """
+        nt = vort_spec.shape[1]
+        vortp, psip = self.to_grid(vort_spec)
+        dpsi_dlamb = d_dlamb(psip, self.dlamb)
+        dpsi_dtheta = d_dtheta(psip, self.dtheta)
+        dvort_dlamb = d_dlamb(vortp, self.dlamb)
+        dvort_dtheta = d_dtheta(vortp, self.dtheta)
+
+        # Beta and advection of perturbation/mean vorticity by the mean/perturbation flow
+        vort_tend = -2. * NL.omega/(NL.Re**2) * dpsi_dlamb - \
+                    self.jac_factor * (self.dpsib_dlamb * dvort_dtheta - dvort_dlamb * self.dpsib_dtheta) - \
+                    self.jac_factor * (dpsi_dlamb * self.dvortb_dtheta - self.dvortb_dlamb * dpsi_dtheta)
+
+        # Apply hyperdiffusion as the nonlinear model does
+        if NL.diff_opt == 'del4':
+            for i in range(nt):
+                vort_tend[:, :, i] -= del4_filter(vortp[:, :, i], self.lats, self.lons)
+        tend_spec = np.reshape(self.s.grdtospec(vort_tend), (self.ncoef, nt))
+        if NL.diff_opt == 'des':
+            DES = self.DES[:, None]
+            tend_spec = (tend_spec - DES * vort_spec) / (1. + DES * NL.dt)
+
+        # Flow of the perturbation over the topography
+        dtopo_dlamb, dtopo_dtheta = self.topo_gradients() if dtopo is None else dtopo
+        topo_tend = -(self.f * self.jac_factor * (dpsi_dlamb * dtopo_dtheta -
+                                                   dtopo_dlamb * dpsi_dtheta)) / NL.fluid_height
+        tend_spec += np.reshape(self.s.grdtospec(topo_tend), (self.ncoef, nt))
+
+        return tend_spec - damping * vort_spec
+
+    def operator(self, damping=0., topo=None):
+        """
+        Returns the linearized tendency as a scipy LinearOperator acting on real
+        state vectors (see pack/unpack).
+
+        Requires:
+        damping -> linear (Rayleigh) damping rate [s^-1]
+        topo ----> 2D (nlats, nlons) topography [m] (None = the model's topography)
+        """
+        dtopo = self.topo_gradients(topo)
+
+        def matmat(x):
+            x = np.reshape(x, (self.nstate, -1))
+            return self.pack(self.tendency_spec(self.unpack(x), damping=damping, dtopo=dtopo))
+
+        def matvec(x):
+            return matmat(x).ravel()
+
+        return LinearOperator((self.nstate, self.nstate), matvec=matvec, matmat=matmat,
+                              dtype=np.float64)
+
+    #==== Normal modes ================================================================
+    def normal_modes(self, nmodes=NL.nmodes, which='LR', tol=NL.eig_tol):
+        """
+        Finds the leading normal modes of the linearized model with ARPACK.
+
+        Requires:
+        nmodes -> number of eigenmodes to compute
+        which --> which eigenvalues to find ('LR' = fastest growing, 'LM' = largest magnitude)
+        tol ----> relative accuracy of the eigenvalues (0 = machine precision)
+
+        Returns:
+        Dictionary of the (up to <nmodes>) modes, sorted from fastest to slowest growing
+        keys: eigenvalues [s^-1], growth_rate [day^-1], frequency [day^-1],
+              vort, psi (complex arrays of shape (nlats, nlons, nmodes))
+        """
+        # Oscillating modes of the real operator come in complex-conjugate pairs, so ask
+        # for twice as many eigenvalues and keep one of each pair (frequency >= 0)
+        vals, vecs = eigs(self.operator(), k=min(2 * nmodes, self.nstate - 2), which=which, tol=tol)
+        keep = np.where(vals.imag >= 0)[0]
+        order = keep[np.argsort(vals[keep].real)[::-1]][:nmodes]
+        vals, vecs = vals[order], vecs[:, order]
+
+        # The real/imaginary parts of each eigenvector are the mode's two phases
+        vort_re, psi_re = self.to_grid(self.unpack(vecs.real))
+        vort_im, psi_im = self.to_grid(self.unpack(vecs.imag))
+
+        return {'eigenvalues' : vals,
+                'growth_rate' : vals.real * 86400.,
+                'frequency' : vals.imag * 86400. / (2 * np.pi),
+                'vort' : vort_re + 1j * vort_im,
+                'psi' : psi_re + 1j * psi_im,
+                }
+
+    #==== Stationary waves ============================================================
+    def stationary_forcing(self, forcing=None, topo=None):
+        """
+        Computes the vorticity tendency that drives the stationary waves: the imposed
+        forcing plus the flow of the basic state over the topography.
+
+        Requires:
+        forcing -> 2D (nlats, nlons) or 3D (nlats, nlons, k) array of vorticity tendency
+                   forcing [s^-2] (None for no forcing)
+        topo ----> 2D (nlats, nlons) or 3D (nlats, nlons, k) array of topography [m]
+                   (None uses the model's topography)
+
+        Returns:
+        3D array (nlats, nlons, k) of vorticity tendency forcing [s^-2]
+        """
+        dtopo_dlamb, dtopo_dtheta = self.topo_gradients(topo)
+        vort_tend = -(self.f * self.jac_factor * (self.dpsib_dlamb * dtopo_dtheta -
+                                                   dtopo_dlamb * self.dpsib_dtheta)) / NL.fluid_height
+        if forcing is not None:
+            vort_tend = vort_tend + np.reshape(forcing, (self.model.nlats(), self.model.nlons(), -1))
+        return vort_tend
+
+    def dense_matrix(self, damping=0., topo=None, blocksize=256):
+        """
+        Assembles the linearized tendency operator as a dense (nstate, nstate) matrix,
+        applying the operator to <blocksize> unit vectors at a time.
+        """
+        op = self.operator(damping=damping, topo=topo)
+        A = np.zeros((self.nstate, self.nstate))
+        for j in range(0, self.nstate, blocksize):
+            cols = np.arange(j, min(j + blocksize, self.nstate))
+            unit = np.zeros((self.nstate, len(cols)))
+            unit[cols, np.arange(len(cols))] = 1.
+            A[:, cols] = op.matmat(unit)
+        return A
+
+    def stationary_response(self, forcing=None, topo=None, damping=NL.stationary_damping,
+                            method=NL.stationary_method, tol=NL.stationary_tol,
+                            restart=NL.stationary_restart, maxiter=NL.stationary_maxiter):
+        """
+        Solves for the steady perturbation that balances the forcing, i.e. L(x) + F = 0
+        where L is the damped linearized tendency operator. The basic state is assumed
+        to be a steady solution of the model (e.g. a zonal flow).
+
+        Requires:
+        forcing -> 2D (nlats, nlons) or 3D (nlats, nlons, k) array of vorticity tendency
+                   forcing [s^-2] (None for no forcing); a 3D array is a batch of k
+                   right-hand sides that are solved for at once
+        topo ----> 2D (nlats, nlons) topography [m] used both in the operator (flow of the
+                   perturbation over it) and in the forcing (None uses the model's);
+                   solve for different topographies with separate calls
+        damping -> linear (Rayleigh) damping rate [s^-1]
+        method --> 'direct' (LU factorization of the dense operator, reused for every
+                   right-hand side and later calls; needs 8*nstate^2 bytes, ~200 MB at
+                   2.5 degrees but ~9 GB at 1 degree) or 'gmres' (Krylov solve per
+                   right-hand side, raises a RuntimeError if any solve does not converge)
+        tol -----> relative tolerance of the GMRES solve (the spharm transforms are single
+                   precision, so residuals stall near 1e-6; tolerances much below ~1e-5
+                   cannot be met)
+        restart -> number of GMRES iterations between restarts
+        maxiter -> maximum number of GMRES restart cycles (None = scipy's default of 10*nstate)
+
+        Returns:
+        Dictionary of the stationary perturbation
+        keys: vort [s^-1], psi [m^2 s^-1] (arrays of shape (nlats, nlons[, k]))
+        """
+        if topo is not None:
+            if np.ndim(topo) == 3 and np.shape(topo)[2] > 1:
+                raise ValueError('topo must be a single 2D field; the operator depends on the '
+                                 'topography, so solve for each topography separately')
+            topo = np.reshape(topo, (self.model.nlats(), self.model.nlons()))
+        vort_tend = self.stationary_forcing(forcing=forcing, topo=topo)
+        nt = vort_tend.shape[2]
+        rhs = -self.pack(np.reshape(self.s.grdtospec(vort_tend), (self.ncoef, nt)))
+
+        if method == 'direct':
+            key = (damping, None if topo is None else
+                   hashlib.sha1(np.ascontiguousarray(topo, dtype=np.float64).tobytes()).hexdigest())
+            if key not in self.lu:
+                self.lu[key] = lu_factor(self.dense_matrix(damping=damping, topo=topo))
+            x = lu_solve(self.lu[key], rhs)
+        elif method == 'gmres':
+            op = self.operator(damping=damping, topo=topo)
+            x = np.zeros(rhs.shape)
+            for i in range(nt):
+                x[:, i], info = gmres(op, rhs[:, i], rtol=tol, atol=0., restart=restart, maxiter=maxiter)
+                if info != 0:
+                    raise RuntimeError('GMRES did not converge for right-hand side {} (info={}); '
+                                       'try a larger restart/maxiter or method=\'direct\''.format(i, info))
+        else:
+            raise ValueError('invalid stationary solver method: {}'.format(method))
+
+        vortp, psip = self.to_grid(self.unpack(x))
+        if np.ndim(forcing) == 3:
+            return {'vort' : vortp, 'psi' : psip}
+        return {'vort' : vortp[:, :, 0], 'psi' : psip[:, :, 0]}
+
+
+###########################################################################################################
+##### Other Utilities #####################################################################################
+###########################################################################################################
+
+def d_dlamb(field, dlamb):
+    """ Finds a finite-difference approximation to gradient in
+    the lambda (longitude) direction for a stack of fields (nlats, nlons, k) """
+    return np.divide(np.gradient(field, axis=1), dlamb)
+
+def d_dtheta(field, dtheta):
+    """ Finds a finite-difference approximation to gradient in
+    the theta (latitude) direction for a stack of fields (nlats, nlons, k) """
+    return np.divide(np.gradient(field, axis=0), dtheta)
+
+###########################################################################################################
+
+def normal_mode_case():
+    """
+    Computes the leading normal modes of the test case basic state (extratropical
+    zonal jets) without integrating the model.
+    """
+    from barotropic_spectral import Model
+    from datetime import datetime
+
+    lons = np.arange(0, 360.1, 2.5)
+    lats = np.arange(-87.5, 88, 2.5)[::-1]
+    lamb, theta = np.meshgrid(lons * np.pi/180., lats * np.pi/180.)
+    ubar = NL.mag * np.cos(theta) - 30 * np.cos(theta)**3 + 300 * np.sin(theta)**2 * np.cos(theta)**6
+    zeros = np.zeros(np.shape(ubar))
+    ics = {'u_bar'  : ubar,
+           'v_bar'  : zeros,
+           'u_prime': zeros,
+           'v_prime': zeros,
+           'lons'   : lons,
+           'lats'   : lats,
+           'start_time' : datetime(2017,1,1,0)}
+
+    modes = LinearModel(Model(ics)).normal_modes()
+    for sigma, freq in zip(modes['growth_rate'], modes['frequency']):
+        print('growth rate: {:8.4f} day^-1   frequency: {:8.4f} day^-1'.format(sigma, freq))
+
+if __name__ == '__main__':
+    normal_mode_case()
@@ -23,14 +23,31 @@ pert_center_lat = 45 # Center latitude of the sinusoidal vorticity perturbation
 pert_width = 15 # Latitudinal width of the vorticity perturbation
 
 # Extra vorticity forcing
-use_forcing = False         # Add a synthetic hurricane or extra forcing to the model.
+use_forcing = False         # Add a synthetic hurricane or extra forcing to the model (a ForcingEngine is always applied).
 forcing_lat = 10            # Latitude center of the forcing
 forcing_lon = 180           # Longitude center of the forcing
 forcing_amp = 10e-10        # Amplitude of the forcing (s^-2)
-forcing_time = 700         # Number of seconds to apply the forcing
+forcing_width = 600e3       # Gaussian standard deviation of the forcing (m)
+forcing_time = 140000       # Number of seconds to apply the forcing (dense forcing arrays only)
+
+# Parallel-in-time integration (parareal.py)
+parareal_slices = None      # Number of time slices/worker processes (None = number of CPUs)
+parareal_tol = 1e-4         # Convergence tolerance (relative change in slice-boundary vorticity)
+parareal_maxiter = 10       # Maximum number of Parareal iterations
+parareal_coarse_dt = 1200   # Time step of the coarse propagator (seconds)
+parareal_coarse_method = 'rk4'  # Integration method of the coarse propagator ('rk4'; leapfrog is unstable at large steps)
+
+# Real-data initial conditions (ingest.py)
+ingest_u = 'u'              # Name of the zonal wind variable in the analysis files
+ingest_v = 'v'              # Name of the meridional wind variable in the analysis files
+ingest_level = 250          # Level to read from the analysis files (units of the file's level coordinate)
+regrid_cachedir = None      # Directory to cache the regridding weights in (None = memory only)
 
 # I/O parameters
 figdir = os.path.join(os.getcwd(), 'figures')  # Figure directory
+traj_file = os.path.join(os.getcwd(), 'trajectories.nc')  # Parcel trajectory output file
+traj_chunk = 10             # Number of output times buffered in memory before writing trajectories
+traj_freq = 1               # Record the parcel positions every <traj_freq> time steps
 
 # Diffusion parameters
 diff_opt = 'des'           # Hyperdiffusion option ('off' = none, 'del4' = del^4, 'des' = DES)
@@ -38,6 +55,15 @@ k = 2.338e16               # Diffusion coefficient for del^4 hyperdiffusion (dif
 nu = 1E-4                  # Dampening coefficient for DES hyperdiffusion (diff_opt='des')
 fourier_inc = 1            # Fourier increment for computing dampening eddy sponge (diff_opt='des')
 
+# Linear model parameters (linear_model.py)
+nmodes = 10                # Number of normal modes to compute
+eig_tol = 1e-8             # Relative accuracy of the normal mode eigenvalues (0 = machine precision)
+stationary_damping = 1./(5*86400.)  # Rayleigh damping rate for the stationary wave solver (s^-1)
+stationary_method = 'direct'  # Stationary wave solver ('direct' = dense LU, 'gmres' = Krylov)
+stationary_tol = 1e-5      # Relative tolerance of the GMRES stationary wave solver (spharm transforms are float32)
+stationary_restart = 100   # Number of GMRES iterations between restarts
+stationary_maxiter = 20    # Maximum number of GMRES restart cycles
+
 # Constants
 Re = 6378100.              # Radius of earth (m)
 omega = 7.292E-5           # Earth's angular momentum (s^-1)
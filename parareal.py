@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""
+Module for integrating a barotropic model in parallel in time with the
+Parareal algorithm.
+
+The forecast is split into time slices. A cheap coarse propagator (large time
+step, NL.parareal_coarse_method) sweeps sequentially through the slices, while
+the model's own integration (NL.integration_method at NL.dt) is run from
+every slice start concurrently in a process pool. The slice-boundary vorticity
+is corrected and the fine solves repeated until it converges.
+"""
+
+import os
+import numpy as np
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor
+import namelist as NL
+
+# Model used by the fine propagator in each worker process
+_model = None
+
+
+def propagate(model, vortp, t0, nsteps, dt, method):
+    """
+    Integrates the model from a given perturbation vorticity.
+
+    Requires:
+    model --> a Model instance (its perturbation fields are overwritten)
+    vortp --> 2D array (nlats, nlons) of perturbation vorticity at time t0 [s^-1]
+    t0 -----> time since the model start [s]
+    nsteps -> number of time steps to take
+    dt -----> time step [s]
+    method -> integration method ('leapfrog', 'rk4')
+
+    Returns:
+    2D array (nlats, nlons) of perturbation vorticity at time t0 + nsteps * dt
+    """
+    metrics = model.grid_metrics()
+    model.set_perturbation(vortp)
+    vortp_prev = None
+    for n in range(nsteps):
+        vortp_prev = model.step(vortp_prev, t0 + n * dt, dt, metrics, method=method)
+    return model.vortp
+
+
+def _init_worker(model):
+    """ Stores the model for the fine propagator in a worker process """
+    global _model
+    _model = model
+
+
+def _fine(args):
+    """ Runs the fine propagator in a worker process """
+    vortp, t0, nsteps = args
+    return propagate(_model, vortp, t0, nsteps, NL.dt, NL.integration_method)
+
+
+def integrate_parareal(model, nslices=NL.parareal_slices, tol=NL.parareal_tol,
+                       maxiter=NL.parareal_maxiter):
+    """
+    Integrates the model NL.ntimes steps with the Parareal algorithm.
+    (No figures are made and the kinetic energy is not tracked.)
+
+    Requires:
+    model ---> an initialized Model instance
+    nslices -> number of time slices (and worker processes); None = number of CPUs
+    tol -----> convergence tolerance on the change in slice-boundary vorticity,
+               relative to its maximum magnitude
+    maxiter -> maximum number of Parareal iterations. After nslices iterations the
+               result is that of the fine propagator run slice by slice; this matches
+               an uninterrupted fine integration (to round-off) only for single-step
+               methods such as RK4, since a leapfrog fine solve restarts every slice
+               with a forward step.
+
+    Returns:
+    U ---------> list of 2D arrays of the perturbation vorticity at the slice boundaries
+    converged -> whether the tolerance was met (or all nslices iterations were taken);
+                 if False, U is only as accurate as the last iteration and a warning is printed
+    """
+    if nslices is None:
+        nslices = os.cpu_count()
+    # Slice boundaries (in fine time steps)
+    bounds = np.unique(np.linspace(0, NL.ntimes, min(nslices, NL.ntimes) + 1).round().astype(int))
+    nslices = len(bounds) - 1
+    times = bounds * NL.dt
+
+    def coarse(vortp, i):
+        # Cover the slice with (at least one) coarse step of about NL.parareal_coarse_dt
+        length = times[i+1] - times[i]
+        nsteps = max(1, int(round(length / NL.parareal_coarse_dt)))
+        return propagate(model, vortp, times[i], nsteps, length / nsteps, NL.parareal_coarse_method)
+
+    # Initial guess from the coarse propagator alone
+    U = [model.vortp.copy()]
+    G = []
+    for i in range(nslices):
+        G.append(coarse(U[i], i))
+        U.append(G[i])
+
+    converged = False
+    with ProcessPoolExecutor(max_workers=nslices, initializer=_init_worker, initargs=(model,)) as pool:
+        for k in range(min(maxiter, nslices)):
+            # The first k slices have converged; run the fine solves of the rest concurrently
+            F = list(pool.map(_fine, [(U[i], times[i], bounds[i+1] - bounds[i]) for i in range(k, nslices)]))
+
+            # Sequential coarse sweep with the Parareal correction
+            U_new = U[:k+1]
+            for i in range(k, nslices):
+                G_new = coarse(U_new[i], i)
+                U_new.append(G_new + F[i-k] - G[i])
+                G[i] = G_new
+            change = max(np.max(np.abs(U_new[i] - U[i])) for i in range(k+1, nslices+1))
+            scale = max(max(np.max(np.abs(u)) for u in U_new), np.finfo(float).tiny)
+            U = U_new
+            print("Parareal iteration {}: relative change in slice-boundary vorticity {:.3e}".format(
+                  k+1, change / scale))
+            if change <= tol * scale or k+1 == nslices:
+                converged = True
+                break
+
+    if not converged:
+        print("WARNING: Parareal did not converge to tol = {:.1e} in {} iterations; the slice-boundary "
+              "vorticity is only approximate (increase maxiter or reduce the coarse time step)".format(
+              tol, maxiter))
+
+    # Leave the model at the end of the forecast
+    model.set_perturbation(U[-1])
+    model.curtime = model.start_time + timedelta(seconds=float(times[-1]))
+    return U, converged
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+"""
+Module for computing Lagrangian trajectories of large sets of parcels through
+the evolving winds of a barotropic model.
+
+Parcel positions are kept as unit vectors on the sphere and advected with
+winds converted to 3D Cartesian components, so parcels cross the poles
+without any coordinate singularity. Winds are interpolated to the parcels
+with vectorized bilinear interpolation (periodic in longitude), and the
+positions are buffered in preallocated arrays that are streamed to a netCDF
+file in chunks.
+"""
+
+import numpy as np
+from netCDF4 import Dataset
+import namelist as NL
+
+
+class Trajectories:
+    """
+    Class for advecting parcels alongside a Model integration and writing
+    their positions to disk.
+    """
+
+    def __init__(self, lats0, lons0, lats, lons, outfile=NL.traj_file, chunk=NL.traj_chunk,
+                 freq=NL.traj_freq):
+        """
+        Initializes the parcels.
+
+        Requires:
+        lats0, lons0 -> 1D arrays of the initial parcel latitudes/longitudes (in degrees)
+        lats, lons ---> 1D arrays of the (regular) model grid latitudes/longitudes (in degrees)
+        outfile ------> netCDF file the parcel positions are written to
+        chunk --------> number of output times buffered in memory before writing to disk
+        freq ---------> record the parcel positions every <freq> time steps
+        """
+        self.nparcels = len(lats0)
+        self.outfile = outfile
+        self.chunk = chunk
+        self.freq = freq
+
+        # 1) GRID FOR INTERPOLATION
+        # Longitudes: only the unique columns of a (possibly 0-360 inclusive) regular grid
+        self.lon0 = lons[0]
+        self.dlon = lons[1] - lons[0]
+        self.ncols = int(round(360. / abs(self.dlon)))
+        # Latitudes: ascending, with the poles appended so parcels can cross them
+        self.flip = lats[0] > lats[-1]
+        lats = np.asarray(lats[::-1] if self.flip else lats, dtype=float)
+        self.south = lats[0] > -90.
+        self.north = lats[-1] < 90.
+        self.ext_lats = np.concatenate(([-90.] if self.south else [], lats, [90.] if self.north else []))
+        lamb, theta = np.meshgrid(np.deg2rad(lons[:self.ncols]), np.deg2rad(lats))
+        # Unit vectors pointing east and north at each grid point
+        self.east = np.stack((-np.sin(lamb), np.cos(lamb), np.zeros(lamb.shape)), axis=-1)
+        self.nrth = np.stack((-np.sin(theta) * np.cos(lamb), -np.sin(theta) * np.sin(lamb),
+                              np.cos(theta)), axis=-1)
+
+        # 2) PREALLOCATED PARCEL ARRAYS
+        self.xyz = lonlat_to_xyz(np.asarray(lats0, dtype=float), np.asarray(lons0, dtype=float))
+        self.lat = np.zeros(self.nparcels)
+        self.lon = np.zeros(self.nparcels)
+        self.lat_buf = np.zeros((self.chunk, self.nparcels), dtype=np.float32)
+        self.lon_buf = np.zeros((self.chunk, self.nparcels), dtype=np.float32)
+        self.time_buf = np.zeros(self.chunk)
+        self.nbuf = 0
+        self.nwritten = 0
+        self.nsteps = 0
+        self.t = 0.
+        self.wind = None
+
+        # 3) OUTPUT FILE
+        self.ds = Dataset(self.outfile, 'w')
+        self.ds.createDimension('time', None)
+        self.ds.createDimension('parcel', self.nparcels)
+        tvar = self.ds.createVariable('time', 'f8', ('time',))
+        tvar.units = 'hours since model start'
+        # One HDF5 chunk per flushed buffer in time, split into ~4 MB pieces along the parcels
+        chunksizes = (self.chunk, int(max(1, min(self.nparcels, 2**20 // self.chunk))))
+        for name, units in [('lat', 'degrees_north'), ('lon', 'degrees_east')]:
+            var = self.ds.createVariable(name, 'f4', ('time', 'parcel'),
+                                         chunksizes=chunksizes)
+            var.units = units
+
+    #==== Winds ======================================================================
+    def cartesian_winds(self, u, v):
+        """
+        Converts grid winds to 3D Cartesian components on the extended (pole-padded)
+        latitude grid.
+
+        Requires:
+        u, v -> 2D arrays (nlats, nlons) of the total zonal/meridional wind [m s^-1]
+
+        Returns:
+        2D array (3, nlats_ext*ncols) of Cartesian wind components [m s^-1], each
+        component raveled so the parcel gathers are contiguous 1D lookups
+        """
+        u = u[::-1, :self.ncols] if self.flip else u[:, :self.ncols]
+        v = v[::-1, :self.ncols] if self.flip else v[:, :self.ncols]
+        wind = u[..., None] * self.east + v[..., None] * self.nrth
+        # The wind at a pole is the mean of the Cartesian wind around the nearest latitude
+        # (minus its component normal to the sphere there)
+        rows = [wind]
+        if self.south:
+            pole = np.mean(wind[0], axis=0)
+            pole[2] = 0.
+            rows.insert(0, np.tile(pole, (1, self.ncols, 1)))
+        if self.north:
+            pole = np.mean(wind[-1], axis=0)
+            pole[2] = 0.
+            rows.append(np.tile(pole, (1, self.ncols, 1)))
+        wind = np.concatenate(rows, axis=0)
+        return np.ascontiguousarray(np.reshape(np.moveaxis(wind, -1, 0), (3, -1)))
+
+    def interp(self, wind, lat, lon):
+        """
+        Bilinearly interpolates the Cartesian winds (periodic in longitude) to the parcels.
+
+        Requires:
+        wind ----> 2D array (3, nlats_ext*ncols) from cartesian_winds
+        lat, lon -> 1D arrays of parcel latitudes/longitudes (in degrees)
+
+        Returns:
+        2D array (nparcels, 3) of Cartesian wind components [m s^-1]
+        """
+        j = np.clip(np.searchsorted(self.ext_lats, lat) - 1, 0, len(self.ext_lats) - 2)
+        wj = (lat - self.ext_lats[j]) / (self.ext_lats[j+1] - self.ext_lats[j])
+        fi = ((lon - self.lon0) / self.dlon) % self.ncols
+        i = np.floor(fi)
+        wi = fi - i
+        i = i.astype(np.intp) % self.ncols
+        # Flat indices of the four surrounding grid points and their weights
+        k00 = j * self.ncols + i
+        k01 = j * self.ncols + (i + 1) % self.ncols
+        k10 = k00 + self.ncols
+        k11 = k01 + self.ncols
+        w11 = wj * wi
+        w10 = wj - w11
+        w01 = wi - w11
+        w00 = 1. - wj - w01
+        out = np.empty((len(lat), 3))
+        for c in range(3):
+            comp = wind[c]
+            out[:, c] = w00 * np.take(comp, k00) + w01 * np.take(comp, k01) + \
+                        w10 * np.take(comp, k10) + w11 * np.take(comp, k11)
+        return out
+
+    #==== Time stepping ==============================================================
+    def start(self, u, v):
+        """ Stores the initial winds and records the initial parcel positions """
+        self.wind = self.cartesian_winds(u, v)
+        self.lat[:], self.lon[:] = xyz_to_lonlat(self.xyz)
+        self.record()
+
+    def step(self, u, v, dt):
+        """
+        Advects the parcels one time step with Heun's method, using the winds at the
+        start (stored) and end (<u>, <v>) of the step.
+
+        Requires:
+        u, v -> 2D arrays (nlats, nlons) of the total winds at the end of the step [m s^-1]
+        dt ---> time step [s]
+        """
+        wind_next = self.cartesian_winds(u, v)
+        k1 = self.interp(self.wind, self.lat, self.lon)
+        xyz_pred = normalize(self.xyz + dt / NL.Re * k1)
+        k2 = self.interp(wind_next, *xyz_to_lonlat(xyz_pred))
+        self.xyz = normalize(self.xyz + 0.5 * dt / NL.Re * (k1 + k2))
+        self.lat[:], self.lon[:] = xyz_to_lonlat(self.xyz)
+        self.wind = wind_next
+        self.t += dt
+        self.nsteps += 1
+        if self.nsteps % self.freq == 0:
+            self.record()
+
+    #==== I/O ========================================================================
+    def record(self):
+        """ Copies the current positions into the output buffer (writing it when full) """
+        self.lat_buf[self.nbuf] = self.lat
+        self.lon_buf[self.nbuf] = self.lon
+        self.time_buf[self.nbuf] = self.t / 3600.
+        self.nbuf += 1
+        if self.nbuf == self.chunk:
+            self.flush()
+
+    def flush(self):
+        """ Writes the buffered positions to the output file """
+        if self.nbuf == 0:
+            return
+        k0, k1 = self.nwritten, self.nwritten + self.nbuf
+        self.ds['time'][k0:k1] = self.time_buf[:self.nbuf]
+        self.ds['lat'][k0:k1, :] = self.lat_buf[:self.nbuf]
+        self.ds['lon'][k0:k1, :] = self.lon_buf[:self.nbuf]
+        self.nwritten = k1
+        self.nbuf = 0
+
+    def close(self):
+        """ Writes any remaining positions and closes the output file """
+        self.flush()
+        self.ds.close()
+
+
+###########################################################################################################
+##### Other Utilities #####################################################################################
+###########################################################################################################
+
+def lonlat_to_xyz(lat, lon):
+    """ Converts latitudes/longitudes (in degrees) to unit vectors (N, 3) """
+    phi, lamb = np.deg2rad(lat), np.deg2rad(lon)
+    return np.stack((np.cos(phi) * np.cos(lamb), np.cos(phi) * np.sin(lamb), np.sin(phi)), axis=-1)
+
+def xyz_to_lonlat(xyz):
+    """ Converts unit vectors (N, 3) to latitudes and longitudes (0-360) in degrees """
+    lat = np.rad2deg(np.arcsin(np.clip(xyz[:, 2], -1., 1.)))
+    lon = np.rad2deg(np.arctan2(xyz[:, 1], xyz[:, 0])) % 360.
+    return lat, lon
+
+def normalize(xyz):
+    """ Projects vectors (N, 3) back onto the unit sphere """
+    return xyz / np.sqrt(np.sum(xyz**2, axis=1))[:, None]